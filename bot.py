@@ -1,5 +1,9 @@
+import asyncio
+import collections
+import copy
+import heapq
+import itertools
 import logging
-import sys
 import os
 import glob
 import datetime
@@ -8,7 +12,7 @@ import openpyxl
 import json
 from datetime import time
 import pytz
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Optional
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     ApplicationBuilder,
@@ -69,8 +73,30 @@ NETWORK_GROUPS = {
     "Днепр": ["", "", ""],
     "Харьков": ["", "", ""]
 }
-# Файл с Telegram ID для автоотчётов (например, [123456789, 987654321])
+# Файл с получателями автоотчётов. Элемент списка – Telegram ID или объект с индивидуальным
+# временем доставки и часовым поясом, например:
+# [123456789, {"id": 987654321, "time": "09:00", "tz": "Europe/Warsaw"}]
 AUTO_REPORT_USERS_FILE = "auto_report_users.json"
+# Часовой пояс ресторанов – в нём вычисляется дата отчёта («вчера»)
+RESTAURANT_TZ = pytz.timezone("Europe/Kiev")
+# Время начала сбора данных для автоотчёта (по RESTAURANT_TZ)
+AUTO_REPORT_FETCH_START = time(hour=0, minute=6, second=0)
+# Окно (в минутах), на которое равномерно распределяются запросы к iiko по точкам
+AUTO_REPORT_FETCH_WINDOW_MINUTES = 30
+# Запас (в минутах) после окна, по истечении которого отчёт отправляется с тем, что успели собрать
+AUTO_REPORT_FETCH_DEADLINE_MARGIN_MINUTES = 15
+
+# ----- Очередь тяжёлых запросов отчётов -----
+# Максимум одновременно выполняемых задач (запросов к iiko)
+REPORT_MAX_CONCURRENT_JOBS = 2
+# Лимит запросов от одного пользователя: не более REPORT_RATE_LIMIT_REQUESTS за период
+REPORT_RATE_LIMIT_REQUESTS = 3
+REPORT_RATE_LIMIT_PERIOD_SECONDS = 60
+# Классы приоритетов (меньше – раньше): плановый автоотчёт, интерактивные запросы по
+# одному заведению. Значения больше PRIORITY_INTERACTIVE зарезервированы для будущих
+# массовых команд (например, по всей сети)
+PRIORITY_SCHEDULED = 0
+PRIORITY_INTERACTIVE = 1
 
 
 # ----------- Функция экранирования Markdown -----------
@@ -85,6 +111,14 @@ def escape_markdown(text: str) -> str:
     return text
 
 
+def get_business_date(days_ago: int = 0) -> str:
+    """
+    Возвращает дату (YYYY-MM-DD) по часовому поясу ресторанов, а не сервера.
+    """
+    today = datetime.datetime.now(RESTAURANT_TZ).date()
+    return (today - datetime.timedelta(days=days_ago)).isoformat()
+
+
 # ----------------- ФУНКЦИИ ДЛЯ IIKO -----------------
 def map_order_type_to_category(order_type_str: str) -> str:
     if not order_type_str:
@@ -116,7 +150,7 @@ def iiko_login(session: requests.Session) -> str:
         return token
     except requests.exceptions.RequestException as exc:
         logging.error("Ошибка при авторизации iiko: %s", exc)
-        sys.exit(1)
+        raise
 
 
 def iiko_logout(session: requests.Session, token: str):
@@ -159,12 +193,12 @@ def fetch_olap_report(session: requests.Session, token: str, body: dict) -> dict
         return data
     except requests.exceptions.RequestException as exc:
         logging.error("Ошибка при получении OLAP: %s", exc)
-        sys.exit(1)
+        raise
 
 
 def get_report_for_department(session: requests.Session, token: str,
                               department_name: str, date_from: str, date_to: str) -> list:
-    filters_updated = FILTERS.copy()
+    filters_updated = copy.deepcopy(FILTERS)
     filters_updated["OpenDate.Typed"]["from"] = f"{date_from}T00:00:00.000"
     filters_updated["OpenDate.Typed"]["to"] = f"{date_to}T00:00:00.000"
     filters_updated["Department"] = {"filterType": "IncludeValues", "values": [department_name]}
@@ -277,8 +311,10 @@ def get_detailed_plan_fact(department: str, target_date: str) -> Dict[str, Any]:
 
     with requests.Session() as session:
         token = iiko_login(session)
-        iiko_data = get_report_for_department(session, token, department, date_from, date_to)
-        iiko_logout(session, token)
+        try:
+            iiko_data = get_report_for_department(session, token, department, date_from, date_to)
+        finally:
+            iiko_logout(session, token)
 
     details = {}
     overall_fact_sales = 0.0
@@ -338,6 +374,119 @@ async def send_long_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, te
         await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode="Markdown")
 
 
+# ----------------- Очередь тяжёлых запросов отчётов -----------------
+class ReportQueue:
+    """
+    Очередь задач отчётов с приоритетами, ограничением числа одновременно выполняемых задач
+    и ограничением частоты запросов от одного пользователя.
+    Задача – корутинная функция; её результат (или None при ошибке) возвращается через future.
+    Ошибка задачи только логируется и не останавливает очередь и цикл событий.
+    """
+
+    def __init__(self, max_concurrent: int, rate_limit: int, rate_period: float):
+        self.max_concurrent = max_concurrent
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self._heap = []
+        self._counter = itertools.count()
+        self._running = 0
+        self._tasks = set()
+        self._user_requests: Dict[int, collections.deque] = {}
+
+    def retry_after(self, user_id: int) -> float:
+        """
+        Сколько секунд пользователю нужно подождать до следующего запроса (0 – можно сейчас).
+        """
+        now = asyncio.get_running_loop().time()
+        requests_log = self._user_requests.get(user_id)
+        if not requests_log:
+            return 0.0
+        while requests_log and now - requests_log[0] >= self.rate_period:
+            requests_log.popleft()
+        if not requests_log:
+            del self._user_requests[user_id]
+            return 0.0
+        if len(requests_log) < self.rate_limit:
+            return 0.0
+        return self.rate_period - (now - requests_log[0])
+
+    def submit(self, priority: int, job, *args, user_id: Optional[int] = None) -> Tuple[asyncio.Future, int]:
+        """
+        Ставит задачу в очередь. Возвращает future с результатом и позицию в очереди
+        (0 – задача запущена сразу).
+        """
+        if user_id is not None:
+            self._user_requests.setdefault(user_id, collections.deque()).append(asyncio.get_running_loop().time())
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._counter), job, args, future)
+        heapq.heappush(self._heap, entry)
+        self._dispatch()
+        if entry not in self._heap:
+            return future, 0
+        position = 1 + sum(1 for other in self._heap if other[:2] < entry[:2])
+        return future, position
+
+    def _dispatch(self):
+        while self._running < self.max_concurrent and self._heap:
+            entry = heapq.heappop(self._heap)
+            self._running += 1
+            task = asyncio.get_running_loop().create_task(self._run(entry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, entry):
+        priority, _, job, args, future = entry
+        result = None
+        try:
+            result = await job(*args)
+        except (Exception, SystemExit) as e:
+            # SystemExit тоже перехватываем: одна упавшая задача не должна останавливать бота
+            logging.error("Ошибка выполнения задачи отчёта (приоритет %s): %r", priority, e)
+        finally:
+            self._running -= 1
+            if not future.done():
+                future.set_result(result)
+            self._dispatch()
+
+
+async def fetch_detailed_plan_fact(department: str, target_date: str) -> Dict[str, Any]:
+    """
+    Асинхронная обёртка get_detailed_plan_fact: запросы к iiko выполняются в пуле потоков,
+    не блокируя цикл событий бота.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, get_detailed_plan_fact, department, target_date)
+
+
+async def submit_report_request(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                priority: int, job, *args) -> bool:
+    """
+    Ставит интерактивный запрос пользователя в очередь отчётов с учётом лимита частоты.
+    Если бот занят, сообщает пользователю позицию в очереди; при ошибке задачи – сообщает об ошибке.
+    Возвращает False, если запрос отклонён из-за лимита.
+    """
+    report_queue: ReportQueue = context.bot_data["report_queue"]
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    wait = report_queue.retry_after(user_id)
+    if wait:
+        await update.effective_message.reply_text(
+            f"Слишком много запросов. Попробуйте через {int(wait) + 1} сек.")
+        return False
+
+    async def run_with_error_reply():
+        try:
+            await job(*args)
+        except (Exception, SystemExit) as e:
+            logging.error("Ошибка формирования отчёта для пользователя %s: %r", user_id, e)
+            await context.bot.send_message(chat_id=chat_id, text="Не удалось сформировать отчёт. Попробуйте позже.")
+
+    _, position = report_queue.submit(priority, run_with_error_reply, user_id=user_id)
+    if position:
+        await update.effective_message.reply_text(f"Бот занят: запрос в очереди, позиция {position}.")
+    return True
+
+
 # ----------------- Интерфейс /get_plan_fact через ConversationHandler -----------------
 GET_DATE, CHOOSE_DEPARTMENT = range(2)
 
@@ -378,10 +527,21 @@ async def choose_department_handler(update: Update, context: ContextTypes.DEFAUL
         await query.edit_message_text("Ошибка: не задана дата.")
         return ConversationHandler.END
 
-    data = get_detailed_plan_fact(department, target_date)
+    if not await submit_report_request(update, context, PRIORITY_INTERACTIVE,
+                                      plan_fact_report_job, query, department, target_date):
+        # Клавиатура остаётся активной – пользователь сможет повторить выбор после ожидания
+        return CHOOSE_DEPARTMENT
+    return ConversationHandler.END
+
+
+async def plan_fact_report_job(query, department: str, target_date: str):
+    """
+    Задача очереди отчётов для /get_plan_fact: получает данные и выводит их вместо выбора заведения.
+    """
+    data = await fetch_detailed_plan_fact(department, target_date)
     if not data:
         await query.edit_message_text("Нет данных для заданных параметров.")
-        return ConversationHandler.END
+        return
 
     # Формируем сообщение с детализацией по категориям и общей сводкой
     emoji_map = {"доставка": "🚚", "зал": "🏰", "агрегаторы": "📦"}
@@ -416,7 +576,6 @@ async def choose_department_handler(update: Update, context: ContextTypes.DEFAUL
         f"• *План Гостей (зал):* {overall.get('plan_guests', 0):.0f} | *Факт Гостей:* {overall.get('fact_guests', 0):.0f}")
     final_text = "\n".join(lines)
     await query.edit_message_text(final_text, parse_mode="Markdown")
-    return ConversationHandler.END
 
 
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -425,10 +584,26 @@ async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ----------------- Новая функция: Агрегированный автоотчёт по сетям -----------------
-def get_aggregated_network_plan_fact(target_date: str) -> Dict[str, Any]:
+def get_network_departments() -> List[str]:
+    """
+    Возвращает список точек из NETWORK_GROUPS, для которых есть Excel-файл.
+    Точка, входящая в несколько сетей, встречается в списке по разу на каждую сеть.
+    """
+    departments = []
+    for network, network_departments in NETWORK_GROUPS.items():
+        for dept in network_departments:
+            file_path = os.path.join(PLAN_FACT_FOLDER, f"{dept}.xlsx")
+            if not os.path.exists(file_path):
+                logging.warning("Файл для точки '%s' не найден, пропускаем.", dept)
+                continue
+            departments.append(dept)
+    return departments
+
+
+def aggregate_network_plan_fact(departments_data: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Для заданной даты (YYYY-MM-DD) получает агрегированные данные по всем точкам, входящим в сети,
-    заданные в NETWORK_GROUPS. Возвращает словарь с агрегированными данными по категориям и общую сводку.
+    Агрегирует детальные план/факт (результаты get_detailed_plan_fact) нескольких точек.
+    Возвращает словарь с агрегированными данными по категориям и общую сводку.
     """
     # Инициализируем аккумуляторы для каждой категории
     agg_categories = {cat: {"plan_sales": 0.0, "fact_sales": 0.0,
@@ -440,35 +615,26 @@ def get_aggregated_network_plan_fact(target_date: str) -> Dict[str, Any]:
                "fact_sales": 0.0, "fact_orders": 0.0,
                "plan_guests": 0.0, "fact_guests": 0.0}
 
-    # Перебираем сети
-    for network, departments in NETWORK_GROUPS.items():
-        for dept in departments:
-            file_path = os.path.join(PLAN_FACT_FOLDER, f"{dept}.xlsx")
-            if not os.path.exists(file_path):
-                logging.warning("Файл для точки '%s' не найден, пропускаем.", dept)
-                continue
-            data = get_detailed_plan_fact(dept, target_date)
-            if not data:
-                continue
-            # По категориям
-            details = data.get("details", {})
-            for cat in CATEGORIES:
-                cat_data = details.get(cat, {})
-                agg_categories[cat]["plan_sales"] += cat_data.get("plan_sales", 0)
-                agg_categories[cat]["fact_sales"] += cat_data.get("fact_sales", 0)
-                agg_categories[cat]["plan_orders"] += cat_data.get("plan_orders", 0)
-                agg_categories[cat]["fact_orders"] += cat_data.get("fact_orders", 0)
-                if cat.lower() == "зал":
-                    agg_categories[cat]["plan_guests"] += cat_data.get("plan_guests", 0)
-                    agg_categories[cat]["fact_guests"] += cat_data.get("fact_guests", 0)
-            # Общая сводка
-            overall_data = data.get("overall", {})
-            overall["plan_total_sales"] += overall_data.get("plan_total_sales", 0)
-            overall["plan_orders"] += overall_data.get("plan_orders", 0)
-            overall["fact_sales"] += overall_data.get("fact_sales", 0)
-            overall["fact_orders"] += overall_data.get("fact_orders", 0)
-            overall["plan_guests"] += overall_data.get("plan_guests", 0)
-            overall["fact_guests"] += overall_data.get("fact_guests", 0)
+    for data in departments_data:
+        # По категориям
+        details = data.get("details", {})
+        for cat in CATEGORIES:
+            cat_data = details.get(cat, {})
+            agg_categories[cat]["plan_sales"] += cat_data.get("plan_sales", 0)
+            agg_categories[cat]["fact_sales"] += cat_data.get("fact_sales", 0)
+            agg_categories[cat]["plan_orders"] += cat_data.get("plan_orders", 0)
+            agg_categories[cat]["fact_orders"] += cat_data.get("fact_orders", 0)
+            if cat.lower() == "зал":
+                agg_categories[cat]["plan_guests"] += cat_data.get("plan_guests", 0)
+                agg_categories[cat]["fact_guests"] += cat_data.get("fact_guests", 0)
+        # Общая сводка
+        overall_data = data.get("overall", {})
+        overall["plan_total_sales"] += overall_data.get("plan_total_sales", 0)
+        overall["plan_orders"] += overall_data.get("plan_orders", 0)
+        overall["fact_sales"] += overall_data.get("fact_sales", 0)
+        overall["fact_orders"] += overall_data.get("fact_orders", 0)
+        overall["plan_guests"] += overall_data.get("plan_guests", 0)
+        overall["fact_guests"] += overall_data.get("fact_guests", 0)
 
     # Вычисляем средние (средний чек) для каждой категории
     for cat in CATEGORIES:
@@ -501,22 +667,14 @@ def get_aggregated_network_plan_fact(target_date: str) -> Dict[str, Any]:
     }
 
 
-async def auto_report_job(context: ContextTypes.DEFAULT_TYPE):
+def build_auto_report_text(target_date: str, agg_data: Dict[str, Any]) -> str:
     """
-    Ежедневная задача, которая отправляет автоотчёт за предыдущий день (агрегированный по всем сетям)
-    на список Telegram-ID, указанных в файле AUTO_REPORT_USERS_FILE.
+    Формирует текст агрегированного автоотчёта (Markdown).
     """
-    # Определяем дату предыдущего дня
-    yesterday = datetime.date.today() - datetime.timedelta(days=1)
-    target_date = yesterday.isoformat()
-
-    # Получаем агрегированные данные
-    agg_data = get_aggregated_network_plan_fact(target_date)
     networks = ", ".join(agg_data["networks"])
     cat_data = agg_data["categories"]
     overall = agg_data["overall"]
 
-    # Формируем текст отчёта
     lines = []
     lines.append(f"*Автоотчёт за {escape_markdown(target_date)}*")
     lines.append(f"\nСеть: {escape_markdown(networks)}")
@@ -551,28 +709,197 @@ async def auto_report_job(context: ContextTypes.DEFAULT_TYPE):
     lines.append(
         f"• *План Гостей (зал):* {overall.get('plan_guests', 0):.0f} | *Факт Гостей:* {overall.get('fact_guests', 0):.0f}")
 
-    final_text = "\n".join(lines)
+    return "\n".join(lines)
 
-    # Читаем список Telegram ID для автоотчётов из JSON-файла
-    if os.path.exists(AUTO_REPORT_USERS_FILE):
-        try:
-            with open(AUTO_REPORT_USERS_FILE, "r", encoding="utf-8") as f:
-                user_ids = json.load(f)
-        except Exception as e:
-            logging.error("Ошибка чтения файла %s: %s", AUTO_REPORT_USERS_FILE, e)
-            return
-    else:
+
+def load_auto_report_recipients() -> Optional[List[Dict[str, Any]]]:
+    """
+    Читает получателей автоотчёта из AUTO_REPORT_USERS_FILE.
+    Элемент файла – Telegram ID либо {"id": ..., "time": "HH:MM", "tz": "..."}.
+    Возвращает список словарей {"id", "time", "tz"}; time = None означает «сразу после сбора».
+    При ошибке чтения возвращает None.
+    """
+    if not os.path.exists(AUTO_REPORT_USERS_FILE):
         logging.warning("Файл %s не найден. Автоотчет не отправлен.", AUTO_REPORT_USERS_FILE)
+        return None
+    try:
+        with open(AUTO_REPORT_USERS_FILE, "r", encoding="utf-8") as f:
+            raw_users = json.load(f)
+    except Exception as e:
+        logging.error("Ошибка чтения файла %s: %s", AUTO_REPORT_USERS_FILE, e)
+        return None
+
+    recipients = []
+    for entry in raw_users:
+        if not isinstance(entry, dict):
+            recipients.append({"id": entry, "time": None, "tz": RESTAURANT_TZ})
+            continue
+        uid = entry.get("id")
+        if uid is None:
+            logging.error("Получатель без id в %s: %s", AUTO_REPORT_USERS_FILE, entry)
+            continue
+        tz = RESTAURANT_TZ
+        if entry.get("tz"):
+            try:
+                tz = pytz.timezone(entry["tz"])
+            except pytz.exceptions.UnknownTimeZoneError:
+                logging.error("Неизвестный часовой пояс '%s' у получателя %s, используем %s.",
+                              entry["tz"], uid, RESTAURANT_TZ.zone)
+        delivery_time = None
+        if entry.get("time"):
+            try:
+                delivery_time = datetime.datetime.strptime(entry["time"], "%H:%M").time()
+            except ValueError:
+                logging.error("Неверное время '%s' у получателя %s, отправим сразу после сбора.",
+                              entry["time"], uid)
+        recipients.append({"id": uid, "time": delivery_time, "tz": tz})
+    return recipients
+
+
+def get_delivery_datetime(recipient: Dict[str, Any], delivery_date: datetime.date,
+                          now: datetime.datetime) -> Optional[datetime.datetime]:
+    """
+    Момент доставки отчёта получателю: его время в дату доставки (день после даты отчёта)
+    в часовом поясе получателя. None – если время не задано или уже прошло (отчёт отправляется сразу).
+    """
+    if recipient["time"] is None:
+        return None
+    tz = recipient["tz"]
+    delivery_dt = tz.localize(datetime.datetime.combine(delivery_date, recipient["time"]))
+    if delivery_dt <= now:
+        return None
+    return delivery_dt
+
+
+async def auto_report_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Ежедневная задача, которая запускает сбор автоотчёта за предыдущий день (по RESTAURANT_TZ).
+    Запросы к iiko по точкам равномерно распределяются на AUTO_REPORT_FETCH_WINDOW_MINUTES минут.
+    Точка, входящая в несколько сетей, запрашивается один раз, но учитывается в каждой сети.
+    """
+    target_date = get_business_date(days_ago=1)
+    departments = get_network_departments()
+    unique_departments = list(dict.fromkeys(departments))
+
+    state = {"target_date": target_date, "pending": set(unique_departments), "results": {},
+             "order": departments, "delivered": False}
+    context.bot_data["auto_report"] = state
+
+    if not unique_departments:
+        await deliver_auto_report(context, state)
         return
 
-    # Отправляем отчёт каждому пользователю из списка
-    for uid in user_ids:
-        try:
-            await context.bot.send_message(chat_id=uid, text=final_text, parse_mode="Markdown")
-        except Exception as e:
-            logging.error("Ошибка отправки автоотчёта пользователю %s: %s", uid, e)
+    step = AUTO_REPORT_FETCH_WINDOW_MINUTES * 60 / len(unique_departments)
+    for i, dept in enumerate(unique_departments):
+        context.job_queue.run_once(
+            auto_report_fetch_job,
+            when=i * step,
+            data={"department": dept, "target_date": target_date},
+            name=f"auto_report_fetch:{dept}",
+            job_kwargs={"misfire_grace_time": None}
+        )
+    # Страховка: если какие-то точки не успели, отчёт всё равно уходит с тем, что собрано
+    context.job_queue.run_once(
+        auto_report_deadline_job,
+        when=(AUTO_REPORT_FETCH_WINDOW_MINUTES + AUTO_REPORT_FETCH_DEADLINE_MARGIN_MINUTES) * 60,
+        data={"target_date": target_date},
+        name="auto_report_deadline",
+        job_kwargs={"misfire_grace_time": None}
+    )
+    logging.info("Сбор автоотчёта за %s: %d точек за %d мин.",
+                 target_date, len(unique_departments), AUTO_REPORT_FETCH_WINDOW_MINUTES)
+
+
+async def auto_report_fetch_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Получает план/факт одной точки для автоотчёта. Последняя точка запускает доставку.
+    """
+    job_data = context.job.data
+    state = context.bot_data.get("auto_report")
+    if not state or state["target_date"] != job_data["target_date"]:
+        logging.warning("Устаревшая задача сбора автоотчёта для '%s', пропускаем.", job_data["department"])
+        return
+
+    dept = job_data["department"]
+    report_queue: ReportQueue = context.bot_data["report_queue"]
+    future, _ = report_queue.submit(PRIORITY_SCHEDULED, fetch_detailed_plan_fact, dept, state["target_date"])
+    data = await future
+    if data is None:
+        logging.warning("Не удалось получить данные точки '%s' для автоотчёта за %s, считаем без данных.",
+                        dept, state["target_date"])
+    if state["delivered"]:
+        logging.warning("Данные точки '%s' получены после отправки автоотчёта за %s, не учтены.",
+                        dept, state["target_date"])
+        return
+    if data:
+        state["results"][dept] = data
+    state["pending"].discard(dept)
+
+    if not state["pending"]:
+        await deliver_auto_report(context, state)
 
-    logging.info("Автоотчёт за %s успешно отправлен.", target_date)
+
+async def auto_report_deadline_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Отправляет автоотчёт по истечении окна сбора, если данные получены не по всем точкам.
+    """
+    state = context.bot_data.get("auto_report")
+    if not state or state["target_date"] != context.job.data["target_date"] or state["delivered"]:
+        return
+    logging.warning("Автоотчёт за %s: не получены данные по точкам: %s. Отправляем собранное.",
+                    state["target_date"], ", ".join(sorted(state["pending"])))
+    await deliver_auto_report(context, state)
+
+
+async def deliver_auto_report(context: ContextTypes.DEFAULT_TYPE, state: Dict[str, Any]):
+    """
+    Агрегирует собранные данные и рассылает отчёт: сразу или в индивидуальное время получателя.
+    """
+    if state["delivered"]:
+        return
+    state["delivered"] = True
+    target_date = state["target_date"]
+    departments_data = [state["results"][dept] for dept in state["order"] if dept in state["results"]]
+    final_text = build_auto_report_text(target_date, aggregate_network_plan_fact(departments_data))
+
+    recipients = load_auto_report_recipients()
+    if recipients is None:
+        return
+
+    delivery_date = datetime.date.fromisoformat(target_date) + datetime.timedelta(days=1)
+    now = datetime.datetime.now(pytz.utc)
+    scheduled = 0
+    for recipient in recipients:
+        delivery_dt = get_delivery_datetime(recipient, delivery_date, now)
+        if delivery_dt is None:
+            await send_auto_report(context, recipient["id"], final_text)
+        else:
+            context.job_queue.run_once(
+                auto_report_send_job,
+                when=delivery_dt,
+                data={"chat_id": recipient["id"], "text": final_text},
+                name=f"auto_report_send:{recipient['id']}"
+            )
+            logging.info("Автоотчёт за %s для %s запланирован на %s.", target_date, recipient["id"], delivery_dt)
+            scheduled += 1
+
+    if scheduled:
+        logging.warning("Отложенная доставка автоотчёта за %s (%d получателей) хранится только в памяти: "
+                        "перезапуск бота до времени доставки отменит её.", target_date, scheduled)
+
+    logging.info("Автоотчёт за %s собран (%d точек).", target_date, len(departments_data))
+
+
+async def auto_report_send_job(context: ContextTypes.DEFAULT_TYPE):
+    job_data = context.job.data
+    await send_auto_report(context, job_data["chat_id"], job_data["text"])
+
+
+async def send_auto_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str):
+    try:
+        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+    except Exception as e:
+        logging.error("Ошибка отправки автоотчёта пользователю %s: %s", chat_id, e)
 
 
 # ----------------- Остальные команды бота -----------------
@@ -603,10 +930,18 @@ async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Нет загруженных файлов для теста.")
         return
     department = os.path.splitext(os.path.basename(files[0]))[0]
-    target_date = datetime.date.today().isoformat()
-    data = get_detailed_plan_fact(department, target_date)
+    target_date = get_business_date()
+    await submit_report_request(update, context, PRIORITY_INTERACTIVE,
+                                test_report_job, context, update.effective_chat.id, department, target_date)
+
+
+async def test_report_job(context: ContextTypes.DEFAULT_TYPE, chat_id: int, department: str, target_date: str):
+    """
+    Задача очереди отчётов для /test.
+    """
+    data = await fetch_detailed_plan_fact(department, target_date)
     if not data:
-        await update.message.reply_text("Нет данных для теста.")
+        await context.bot.send_message(chat_id=chat_id, text="Нет данных для теста.")
         return
 
     emoji_map = {"доставка": "🚚", "зал": "🏰", "агрегаторы": "📦"}
@@ -640,12 +975,14 @@ async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lines.append(
         f"• *План Гостей (зал):* {overall.get('plan_guests', 0):.0f} | *Факт Гостей:* {overall.get('fact_guests', 0):.0f}")
     final_text = "\n".join(lines)
-    await send_long_message(context, update.effective_chat.id, final_text)
+    await send_long_message(context, chat_id, final_text)
 
 
 def main():
     os.makedirs(PLAN_FACT_FOLDER, exist_ok=True)
     app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app.bot_data["report_queue"] = ReportQueue(
+        REPORT_MAX_CONCURRENT_JOBS, REPORT_RATE_LIMIT_REQUESTS, REPORT_RATE_LIMIT_PERIOD_SECONDS)
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("get_plan_fact", get_plan_fact_start)],
@@ -662,11 +999,10 @@ def main():
     app.add_handler(CommandHandler("test", test_command))
     app.add_handler(conv_handler)
 
-    # Регистрируем ежедневное выполнение автоотчёта (например, в 09:00)
-    kiev_tz = pytz.timezone("Europe/Kiev")
+    # Регистрируем ежедневный старт сбора автоотчёта; доставка – по расписанию получателей
     app.job_queue.run_daily(
         auto_report_job,
-        time=time(hour=00, minute=6, second=0, tzinfo=kiev_tz),
+        time=AUTO_REPORT_FETCH_START.replace(tzinfo=RESTAURANT_TZ),
         name="auto_report_job"
     )
 